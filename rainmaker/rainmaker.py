@@ -28,22 +28,35 @@ Example:
 """
 
 import os
+import sys
 import time
+import difflib
 import argparse
+import tempfile
+import warnings
+import functools
 
 import numpy as np
 import numpy.polynomial.polynomial as poly
 
-from astropy.io import ascii
+from astropy.io import ascii, fits
 from astropy.table import QTable
 import astropy.units as u
 import astropy.constants as const
+from astropy.utils.exceptions import AstropyUserWarning
 
 import matplotlib.pyplot as plt
 import matplotlib.style as style
 
-# Ignore sqrt warnings to keep interpreter clean
-np.seterr(divide='ignore', invalid='ignore')
+try:
+    from numba import njit
+except ImportError:
+    # Numba is optional. Without it, the kernels below run as plain numpy.
+    def njit(*args, **kwargs):
+        """Stand in for numba.njit, returning the function unchanged."""
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda function: function
 
 __author__ = "Dr. Grant R. Tremblay"
 __license__ = "MIT"
@@ -52,6 +65,37 @@ __maintainer__ = "Grant Tremblay"
 __email__ = "grant.tremblay@yale.edu"
 __status__ = "Development"
 
+# The radii across which fits are extrapolated never change, so build
+# them once at import. The grid is uniform in log10(r / Mpc), and
+# ln(10**x) = x * ln(10) gives its natural log without another log().
+_LOG10_R_FINE = np.linspace(-3.0, -0.01, 300)
+_R_FINE_VALUES = np.logspace(-3.0, -0.01, 300)
+_LN_R_FINE = _LOG10_R_FINE * np.log(10.0)
+
+# Vandermonde matrices hold powers of ln(r) up to the highest order fit
+# (the cubic pressure profile). Lower order fits use their first
+# deg + 1 columns. The fine grid's matrix is constant too.
+_VANDER_DEG = 3
+_VANDER_FINE = poly.polyvander(_LN_R_FINE, _VANDER_DEG)
+
+# These are shared by every call, so guard them against mutation
+for _grid in (_LOG10_R_FINE, _R_FINE_VALUES, _LN_R_FINE, _VANDER_FINE):
+    _grid.flags.writeable = False
+del _grid
+
+# Parsed data tables are cached next to the ASCII table as
+# <table>.rainmaker-cache.fits. The header keyword marks the file as
+# ours; bump the version whenever the cached table's layout changes
+# (columns, units, sort order), so that old caches are rebuilt rather
+# than trusted.
+_CACHE_SUFFIX = '.rainmaker-cache.fits'
+_CACHE_KEYWORD = 'RMCACHE'
+_CACHE_VERSION = 1
+
+# Unit conversions used by the numerics, as plain floats
+_MU_MP_G = const.m_p.to(u.g).value  # Proton mass 1.67e-24 g
+_KEV_TO_ERG = (1.0 * u.keV).to(u.erg).value
+
 
 def parse_arguments():
     """Set up and parse command line arguments."""
@@ -77,10 +121,11 @@ def parse_arguments():
                         dest="show_plots",
                         required=False,
                         default=True,
-                        help="Show plots upon running script?")
+                        help="Show plots upon running script?",
+                        type=lambda x: str_to_bool(parser, x))
 
     args = parser.parse_args()
-    filename = args.filename.name
+    filename = args.filename
     show_plots = args.show_plots
 
     # Be flexible with the cluster name.
@@ -98,105 +143,248 @@ def is_valid_file(parser, arg):
         parser.error("Cannot find that data table: {}".format(arg))
     else:
         print("\nTable found    |  {}".format(arg))
-        return open(arg, 'r')      # return an open file handle
+        return arg      # return the path; ascii.read() opens it later
+
+
+def str_to_bool(parser, arg):
+    """Interpret a command line value such as 'False' as a boolean."""
+    if arg.lower() in ('true', 't', 'yes', 'y', '1'):
+        return True
+    elif arg.lower() in ('false', 'f', 'no', 'n', '0'):
+        return False
+    else:
+        parser.error("Expected True or False, got: {}".format(arg))
 
 
 def parse_data_table(filename, cluster_name):
     """Match input cluster name to that in table, return that object's data."""
-    data = ascii.read(filename)     # This creates a flexible Astropy TABLE
+    # Use the in-memory table directly, rather than copying all of it,
+    # and copy only the cluster's rows out, so that changes to them
+    # can't leak back into the cached table.
+    data = _read_data_table(os.path.abspath(filename),
+                            os.path.getmtime(filename))
+
+    # That table is sorted by name, so binary search it for the
+    # cluster, whose rows come back as a contiguous slice
+    names = np.asarray(data['Name'])
+    lo = np.searchsorted(names, cluster_name, side='left')
+    hi = np.searchsorted(names, cluster_name, side='right')
+
+    data = _select_cluster(data, names, cluster_name, slice(lo, hi),
+                           hi > lo).copy()
+
+    return data
+
+
+def read_data_table(filename):
+    """Read the whole data table, with units, via a binary FITS cache.
+
+    Parsing the ASCII table is slow, so the parsed QTable is written
+    next to it (e.g. accept_main_table.txt.rainmaker-cache.fits) and
+    reused for as long as it is newer than the ASCII table. A file at
+    that path which rainmaker didn't write is neither read nor
+    overwritten. The table is sorted by cluster name.
+
+    Tables are also kept in memory, keyed on the file's path and
+    modification time, so repeated calls (e.g. in a notebook session)
+    don't read the file again. Each call returns its own copy, which
+    is safe to modify.
+    """
+    data = _read_data_table(os.path.abspath(filename),
+                            os.path.getmtime(filename))
+
+    return data.copy()
+
 
-    # 'tcool5/2' is a bad column name. Change it if there.
-    if 'tcool5/2' in data.columns:
-        data.rename_column('tcool5/2', 'tcool52')
+@functools.lru_cache(maxsize=4)
+def _read_data_table(filename, mtime):
+    """Do the work of read_data_table(); MTIME is only a cache key."""
+    cache = filename + _CACHE_SUFFIX
+    cache_version = _cache_version(cache)
 
-    # 'tcool3/2' is also a bad column name. Change it if there.
-    if 'tcool3/2' in data.columns:
-        data.rename_column('tcool3/2', 'tcool32')
+    data = None
+    if (cache_version == _CACHE_VERSION and
+            os.path.getmtime(cache) >= os.path.getmtime(filename)):
+        # A damaged cache (e.g. from an interrupted run) still carries
+        # our header, so parse the ASCII table and replace it instead
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', AstropyUserWarning)
+                data = _read_cache(cache)
+        except Exception:
+            data = None
 
-    data = filter_by_cluster(data, cluster_name)
+    if data is None:
+        data = ascii.read(filename)     # This creates a flexible Astropy TABLE
 
-    data = assign_units(data)
+        # 'tcool5/2' is a bad column name. Change it if there.
+        if 'tcool5/2' in data.columns:
+            data.rename_column('tcool5/2', 'tcool52')
+
+        # 'tcool3/2' is also a bad column name. Change it if there.
+        if 'tcool3/2' in data.columns:
+            data.rename_column('tcool3/2', 'tcool32')
+
+        data = assign_units(data)
+
+        # The sort is stable, so each cluster's radial bins stay in order
+        data.sort('Name', kind='stable')
+
+        # Only replace a missing cache or one of our own
+        if cache_version is not None or not os.path.exists(cache):
+            _write_cache(data, cache)
+
+    return data
+
+
+def _read_cache(cache):
+    """Read a table cache written by _write_cache()."""
+    data = QTable.read(cache, format='fits')
+    data.meta.pop(_CACHE_KEYWORD, None)
+
+    # FITS stores strings as bytes. Match them to the str names.
+    data.convert_bytestring_to_unicode()
+
+    # FITS also stores floats big-endian. Swap them to native
+    # byte order once, rather than in every later ufunc.
+    for name in data.colnames:
+        if data[name].dtype.kind == 'f' and \
+                not data[name].dtype.isnative:
+            data[name] = data[name].astype(
+                data[name].dtype.newbyteorder('='))
 
     return data
 
 
+def _write_cache(data, cache):
+    """Write DATA to the table cache at CACHE.
+
+    The table is written to a temporary file that then replaces CACHE,
+    so that an interrupted run, or two runs at once, can't leave a
+    half-written cache behind. The cache is only an optimization, so
+    don't fail if e.g. the table lives in a read-only directory.
+    """
+    directory, basename = os.path.split(cache)
+    data.meta[_CACHE_KEYWORD] = _CACHE_VERSION
+    try:
+        fd, temp_cache = tempfile.mkstemp(suffix=_CACHE_SUFFIX,
+                                          prefix=basename + '.',
+                                          dir=directory)
+        os.close(fd)
+        try:
+            # mkstemp() makes the file private; the cache needn't be
+            os.chmod(temp_cache, 0o644)
+            data.write(temp_cache, format='fits', overwrite=True)
+            os.replace(temp_cache, cache)
+        except BaseException:
+            os.remove(temp_cache)
+            raise
+    except OSError:
+        pass
+    finally:
+        del data.meta[_CACHE_KEYWORD]
+
+
+def _cache_version(cache):
+    """Return the version of a rainmaker table cache.
+
+    Return None if CACHE doesn't exist or wasn't written by rainmaker.
+    """
+    try:
+        with warnings.catch_warnings():
+            # e.g. "File may have been truncated", which the read handles
+            warnings.simplefilter('ignore', AstropyUserWarning)
+            return fits.getheader(cache, 1).get(_CACHE_KEYWORD)
+    except (OSError, IndexError):
+        return None
+
+
+class ClusterNotFoundError(ValueError):
+    """The requested cluster is not in the data table."""
+
+
 def filter_by_cluster(data, cluster_name):
-    """Take input astropy TABLE object."""
-    obs_by_name = data.group_by('Name')
-    clusters_in_table = obs_by_name.groups.keys
+    """Take input astropy TABLE object, return the rows of one cluster.
 
-    cluster_found = cluster_name in clusters_in_table['Name']
+    If the cluster is not in the table, raise a ClusterNotFoundError
+    that suggests the closest matching names instead of prompting.
+    """
+    names = np.asarray(data['Name'])
+    rows = names == cluster_name
 
-    while not cluster_found:
-        new_cluster_name = input("Cluster (" + cluster_name +
-                                 ") not found, try again: ")
+    return _select_cluster(data, names, cluster_name, rows, np.any(rows))
 
-        messyname = (new_cluster_name.startswith('"') and
-                     new_cluster_name.endswith('"'))
 
-        # If the user entered quotation marks, strip them
-        if messyname:
-            cluster_name = new_cluster_name[1:-1].replace(' ', '_').upper()
-        else:
-            cluster_name = new_cluster_name.replace(' ', '_').upper()
-        cluster_found = cluster_name in clusters_in_table['Name']
+def _select_cluster(data, names, cluster_name, rows, cluster_found):
+    """Return DATA[ROWS], or raise ClusterNotFoundError if not found."""
+    if not cluster_found:
+        close_matches = difflib.get_close_matches(cluster_name,
+                                                  set(names.tolist()),
+                                                  n=5, cutoff=0.6)
+        message = "Cluster ({}) not found".format(cluster_name)
+        if close_matches:
+            message += ", did you mean: {}?".format(", ".join(close_matches))
+        raise ClusterNotFoundError(message)
 
-    if cluster_found:
-        print("Cluster found  |  " + cluster_name)
-        mask = data['Name'] == cluster_name
-        masked_data = data[mask]
-        return masked_data
+    print("Cluster found  |  " + cluster_name)
+    masked_data = data[rows]
+    return masked_data
 
 
 def assign_units(data):
-    """I need to write a docstring for this."""
-    Name = data['Name']
-    Rin = data['Rin'] * u.Mpc
-    Rout = data['Rout'] * u.Mpc
-    nelec = data['nelec'] * u.cm**(-3)
-    neerr = data['neerr'] * u.cm**(-3)
-    Kitpl = data['Kitpl'] * u.keV * u.cm**2
-    Kflat = data['Kflat'] * u.keV * u.cm**2
-    Kerr = data['Kerr'] * u.keV * u.cm**2
-    Pitpl = data['Pitpl'] * u.dyne * u.cm**(-2)
-    Perr = data['Perr'] * u.dyne * u.cm**(-2)
-    Mgrav = data['Mgrav'] * u.M_sun
-    Merr = data['Merr'] * u.M_sun
-    Tx = data['Tx'] * u.keV
-    Txerr = data['Txerr'] * u.keV
-    Lambda = data['Lambda'] * u.erg * u.cm**3 / u.s
-    tcool52 = data['tcool52'] * u.Gyr
-    tcool52err = data['t52err'] * u.Gyr
-    tcool32 = data['tcool32'] * u.Gyr
-    tcool32err = data['t32err'] * u.Gyr
-
-    names = ('Name', 'Rin', 'Rout', 'nelec', 'neerr', 'Kitpl',
-             'Kflat', 'Kerr', 'Pitpl', 'Perr', 'Mgrav', 'Merr',
-             'Tx', 'Txerr', 'Lambda', 'tcool52', 't52err',
-             'tcool32', 't32err'
-             )
+    """Attach physical units to the columns of an ACCEPT table.
+
+    Units are set in place on the existing columns, so no column
+    data are copied. Columns not listed below are left untouched.
+    """
+    units = {'Rin': u.Mpc,
+             'Rout': u.Mpc,
+             'nelec': u.cm**(-3),
+             'neerr': u.cm**(-3),
+             'Kitpl': u.keV * u.cm**2,
+             'Kflat': u.keV * u.cm**2,
+             'Kerr': u.keV * u.cm**2,
+             'Pitpl': u.dyne * u.cm**(-2),
+             'Pflat': u.dyne * u.cm**(-2),
+             'Perr': u.dyne * u.cm**(-2),
+             'Mgrav': u.M_sun,
+             'Merr': u.M_sun,
+             'Tx': u.keV,
+             'Txerr': u.keV,
+             'Lambda': u.erg * u.cm**3 / u.s,
+             'tcool52': u.Gyr,
+             't52err': u.Gyr,
+             'tcool32': u.Gyr,
+             't32err': u.Gyr
+             }
+
+    for column, unit in units.items():
+        if column in data.columns:
+            data[column].unit = unit
 
     # Note, this is an astropy QTable instead of a Table, so
     # that I can preserve units. Read more here:
     # http://docs.astropy.org/en/stable/table/mixin_columns.html#quantity-and-qtable
-    data = QTable(
-        [Name, Rin, Rout, nelec, neerr, Kitpl,
-         Kflat, Kerr, Pitpl, Perr, Mgrav, Merr,
-         Tx, Txerr, Lambda, tcool52, tcool52err,
-         tcool32, tcool32err], names=names
-    )
+    # copy=False turns the unit-bearing columns into Quantity
+    # views of the same memory.
+    data = QTable(data, copy=False)
 
     return data
 
 
-def fit_polynomial(data, ln_xray_property, deg, whatIsFit):
+def fit_polynomial(data, ln_xray_property, deg, whatIsFit,
+                   radiuspackage=None):
     """Fit a DEG-order polynomial in x, y space.
 
     numpy.polynomial.polinomial.polyfit() returns coefficients,
     from 0th order first to N-th order last (note that this is
     *opposite* from how np.polyfit behaves!).
+
+    Pass a RADIUSPACKAGE from extrapolate_radius() to avoid
+    recomputing it; otherwise it is derived from DATA.
     """
-    radiuspackage = extrapolate_radius(data)
+    if radiuspackage is None:
+        radiuspackage = extrapolate_radius(data)
 
     r = radiuspackage[0]
     ln_r = radiuspackage[1]
@@ -206,48 +394,128 @@ def fit_polynomial(data, ln_xray_property, deg, whatIsFit):
     print("Now fitting    |" + "  " + make_number_ordinal(deg) +
           " order polynomial to " + whatIsFit)
 
-    coeffs = poly.polyfit(ln_r, ln_xray_property, deg)
+    if deg <= _VANDER_DEG and len(ln_r) > _VANDER_DEG:
+        # Reuse the Vandermonde matrices and QR factors shared by
+        # all fits on these radii
+        vander = radiuspackage[5][:, :deg + 1]
+        vander_fine = radiuspackage[6][:, :deg + 1]
+
+        try:
+            coeffs = qr_polyfit(radiuspackage[7], ln_xray_property, deg)
+        except np.linalg.LinAlgError:
+            # Repeated radii leave too few distinct ones for this order,
+            # so do the rank-deficient fit that poly.polyfit() would
+            coeffs = lstsq_polyfit(vander, ln_xray_property)
+    else:
+        # Higher order than the shared matrices hold, or too few
+        # radii for their QR factors to be of full rank
+        vander = poly.polyvander(ln_r, deg)
+        vander_fine = poly.polyvander(ln_r_fine, deg)
+
+        coeffs = lstsq_polyfit(vander, ln_xray_property)
 
-    # polyval() is used to assemble cubic fit:
+    # The Vandermonde matrix times the coefficients assembles cubic fit:
     # $p(x) = c_0 + c_1 x + c_2 x^2 + c3 x^3$
-    # where c_n are the coeffs returned by polyfit()
-    ln_fit = poly.polyval(ln_r, coeffs)
+    # where c_n are the coeffs returned by the fit
+    ln_fit = vander.dot(coeffs)
     fit = np.exp(ln_fit)
 
     # Now use these coefficients to extrapolate fit
     # across larger radius
 
-    ln_fit_fine = poly.polyval(ln_r_fine, coeffs)
+    ln_fit_fine = vander_fine.dot(coeffs)
     fit_fine = np.exp(ln_fit_fine)
 
-    fitpackage = (fit, r, fit_fine, r_fine, coeffs)
+    # Hand back the log-space fits too, so that callers working
+    # in log space need not undo the exp()
+    fitpackage = (ln_fit, fit, r, ln_fit_fine, fit_fine, r_fine, coeffs)
 
     return fitpackage
 
 
+def lstsq_polyfit(vander, y):
+    """Least-squares polynomial fit on a precomputed Vandermonde matrix.
+
+    This is what poly.polyfit() does internally, including its column
+    scaling, but it lets several fits share one Vandermonde matrix.
+    """
+    rcond = len(vander) * np.finfo(vander.dtype).eps
+
+    # Scale the columns to improve the condition number
+    scale = np.sqrt(np.square(vander).sum(axis=0))
+    scale[scale == 0] = 1
+
+    coeffs = np.linalg.lstsq(vander / scale, y, rcond=rcond)[0]
+
+    return (coeffs.T / scale).T
+
+
+def factor_vander(vander):
+    """QR factorize a Vandermonde matrix for qr_polyfit().
+
+    The columns are scaled first, as in lstsq_polyfit().
+    Return (q, r, scale).
+    """
+    scale = np.sqrt(np.square(vander).sum(axis=0))
+    scale[scale == 0] = 1
+
+    q, r = np.linalg.qr(vander / scale)
+
+    return q, r, scale
+
+
+def qr_polyfit(vander_qr, y, deg):
+    """Least-squares DEG-order polynomial fit from factor_vander() output.
+
+    The QR factors of the first deg + 1 columns of a matrix are the
+    leading blocks of its own QR factors, so one factorization serves
+    every fit up to the matrix's order.
+
+    Raise numpy.linalg.LinAlgError if the fit is rank deficient,
+    which lstsq_polyfit() handles instead.
+    """
+    q, r, scale = vander_qr
+    k = deg + 1
+
+    # R's diagonal shows the rank, with the tolerance lstsq_polyfit() uses
+    diag = np.abs(np.diagonal(r[:k, :k]))
+    if diag.min() <= len(q) * np.finfo(r.dtype).eps * diag.max():
+        raise np.linalg.LinAlgError("Rank-deficient polynomial fit")
+
+    coeffs = np.linalg.solve(r[:k, :k], q[:, :k].T.dot(y))
+
+    return (coeffs.T / scale[:k]).T
+
+
 def extrapolate_radius(data):
     """The ACCEPT radii are finite. Fix that."""
     r = (data['Rin'] + data['Rout']) * 0.5
     ln_r = np.log(r.value)
     # this is the NATURAL logarithm, ln
 
-    # Generate the radii you wish to extrapolate
-    # across in log10 space
-    log10_r_fine = np.arange(300.) / 100. - 3.
+    # The radii you wish to extrapolate across in log10 space
+    log10_r_fine = _LOG10_R_FINE
 
     # Now un-log10 it, give it a unit
-    r_fine = (10**log10_r_fine) * u.Mpc
+    r_fine = _R_FINE_VALUES * u.Mpc
 
     # Also give its unitless natural log, used for fitting
     # with polyval() and fit_polynomial()'s coefficients
-    ln_r_fine = np.log(r_fine.value)
+    ln_r_fine = _LN_R_FINE
 
-    radiuspackage = (r, ln_r, r_fine, log10_r_fine, ln_r_fine)
+    # Vandermonde matrices of ln_r and ln_r_fine, and the QR factors
+    # of the former, which the temperature and pressure fits share
+    vander = poly.polyvander(ln_r, _VANDER_DEG)
+    vander_fine = _VANDER_FINE
+    vander_qr = factor_vander(vander)
+
+    radiuspackage = (r, ln_r, r_fine, log10_r_fine, ln_r_fine,
+                     vander, vander_fine, vander_qr)
 
     return radiuspackage
 
 
-def logTemp_fit(data):
+def logTemp_fit(data, show_plots=True, radiuspackage=None):
     """Fit the Temperature profile in log space.
 
     Fit the logarithmic electron density profile ln(n_e) (in cm^-3)
@@ -260,50 +528,59 @@ def logTemp_fit(data):
     # (that then rises sharply at small radii).
     deg = 2
 
-    ln_t = np.log(data['Tx'].value)
-    ln_terr = np.log(data['Txerr'] / data['Tx'])
+    # Work on the bare arrays; units are only needed for plotting
+    tx = data['Tx'].value
+    txerr = data['Txerr'].value
 
-    upperbound = data['Tx'] + data['Txerr']
-    lowerbound = data['Tx'] - data['Txerr']
+    ln_t = np.log(tx)
+    rel_terr = txerr / tx
 
-    fitpackage = fit_polynomial(data, ln_t, deg, whatIsFit)
+    fitpackage = fit_polynomial(data, ln_t, deg, whatIsFit, radiuspackage)
 
-    temp_fit = fitpackage[0]
-    r = fitpackage[1]
-    temp_fit_fine = fitpackage[2]
-    r_fine = fitpackage[3]
-    temp_coeffs = fitpackage[4]
+    ln_temp_fit = fitpackage[0]
+    temp_fit = fitpackage[1]
+    r = fitpackage[2]
+    ln_temp_fit_fine = fitpackage[3]
+    temp_fit_fine = fitpackage[4]
+    r_fine = fitpackage[5]
+    temp_coeffs = fitpackage[6]
 
     temp_fit = temp_fit * u.keV
     temp_fit_fine = temp_fit_fine * u.keV
 
-    plotter(r.to(u.kpc),
-            data['Tx'],
-            r_fine.to(u.kpc),
-            temp_fit,
-            temp_fit_fine,
-            lowerbound,
-            upperbound,
-            xlog=True,
-            ylog=False,
-            xlim=(1, 100),  # Example: (1, 100)
-            ylim=(1, 5),
-            xlabel="Cluster-centric Radius (kpc)",
-            ylabel="Projected X-ray Temperature (keV)",
-            title="Temperature Fit",
-            file="temperature.pdf",
-            save=False
-            )
+    if show_plots:
+        upperbound = data['Tx'] + data['Txerr']
+        lowerbound = data['Tx'] - data['Txerr']
+
+        plotter(r.to(u.kpc),
+                data['Tx'],
+                r_fine.to(u.kpc),
+                temp_fit,
+                temp_fit_fine,
+                lowerbound,
+                upperbound,
+                xlog=True,
+                ylog=False,
+                xlim=(1, 100),  # Example: (1, 100)
+                ylim=(1, 5),
+                xlabel="Cluster-centric Radius (kpc)",
+                ylabel="Projected X-ray Temperature (keV)",
+                title="Temperature Fit",
+                file="temperature.pdf",
+                save=False
+                )
 
     temppackage = {'temp_coeffs': temp_coeffs,
+                   'ln_temp_fit': ln_temp_fit,
+                   'ln_temp_fit_fine': ln_temp_fit_fine,
                    'temp_fit': temp_fit,
                    'temp_fit_fine': temp_fit_fine,
-                   'ln_terr': ln_terr}
+                   'rel_terr': rel_terr}
 
     return temppackage
 
 
-def logPressure_fit(data):
+def logPressure_fit(data, show_plots=True, radiuspackage=None):
     """Fit the logarithmic electron density profile.
 
     Fit the logarithmic electron density profile ln(n_e) (in cm^-3)
@@ -315,107 +592,130 @@ def logPressure_fit(data):
 
     deg = 3
 
-    ln_p = np.log(data['Pitpl'].value)
-    ln_perr = np.log(data['Perr'] / data['Pitpl'])
+    # Work on the bare arrays; units are only needed for plotting
+    pitpl = data['Pitpl'].value
+    perr = data['Perr'].value
 
-    upperbound = data['Pitpl'] + data['Perr']
-    lowerbound = data['Pitpl'] - data['Perr']
+    ln_p = np.log(pitpl)
+    rel_perr = perr / pitpl
 
-    fitpackage = fit_polynomial(data, ln_p, deg, whatIsFit)
+    fitpackage = fit_polynomial(data, ln_p, deg, whatIsFit, radiuspackage)
 
-    pressure_fit = fitpackage[0]
-    r = fitpackage[1]
-    pressure_fit_fine = fitpackage[2]
-    r_fine = fitpackage[3]
-    pressure_coeffs = fitpackage[4]
+    ln_pressure_fit = fitpackage[0]
+    pressure_fit = fitpackage[1]
+    r = fitpackage[2]
+    ln_pressure_fit_fine = fitpackage[3]
+    pressure_fit_fine = fitpackage[4]
+    r_fine = fitpackage[5]
+    pressure_coeffs = fitpackage[6]
 
     pressure_fit = pressure_fit * u.dyne * u.cm**(-2)
     pressure_fit_fine = pressure_fit_fine * u.dyne * u.cm**(-2)
 
-    plotter(r.to(u.kpc),
-            data['Pitpl'],
-            r_fine.to(u.kpc),
-            pressure_fit,
-            pressure_fit_fine,
-            lowerbound,
-            upperbound,
-            xlog=True,
-            ylog=True,
-            xlim=None,
-            ylim=None,
-            xlabel="Cluster-centric Radius (kpc)",
-            ylabel=r'Projected X-ray Pressure (erg cm$^{-3}$)',
-            title="Pressure Fit",
-            file="pressure.pdf",
-            save=False
-            )
+    if show_plots:
+        upperbound = data['Pitpl'] + data['Perr']
+        lowerbound = data['Pitpl'] - data['Perr']
+
+        plotter(r.to(u.kpc),
+                data['Pitpl'],
+                r_fine.to(u.kpc),
+                pressure_fit,
+                pressure_fit_fine,
+                lowerbound,
+                upperbound,
+                xlog=True,
+                ylog=True,
+                xlim=None,
+                ylim=None,
+                xlabel="Cluster-centric Radius (kpc)",
+                ylabel=r'Projected X-ray Pressure (erg cm$^{-3}$)',
+                title="Pressure Fit",
+                file="pressure.pdf",
+                save=False
+                )
 
     pressurepackage = {'pressure_coeffs': pressure_coeffs,
+                       'ln_pressure_fit': ln_pressure_fit,
+                       'ln_pressure_fit_fine': ln_pressure_fit_fine,
                        'pressure_fit': pressure_fit,
                        'pressure_fit_fine': pressure_fit_fine,
-                       'ln_perr': ln_perr
+                       'rel_perr': rel_perr
                        }
 
     return pressurepackage
 
 
-def grav_accel(data):
-    """Compute the gravitational acceleration from the T and P profiles."""
-    temppackage = logTemp_fit(data)
-    pressurepackage = logPressure_fit(data)
-    radiuspackage = extrapolate_radius(data)
+def grav_accel(data, show_plots=True, radiuspackage=None):
+    """Compute the gravitational acceleration from the T and P profiles.
+
+    Pass a RADIUSPACKAGE from extrapolate_radius() to reuse it;
+    otherwise it is derived from DATA.
+    """
+    # Compute the radii once and share them with both fits
+    if radiuspackage is None:
+        radiuspackage = extrapolate_radius(data)
+    temppackage = logTemp_fit(data, show_plots=show_plots,
+                              radiuspackage=radiuspackage)
+    pressurepackage = logPressure_fit(data, show_plots=show_plots,
+                                      radiuspackage=radiuspackage)
 
     temp_fit = temppackage['temp_fit']
     temp_fit_fine = temppackage['temp_fit_fine']
-    ln_terr = temppackage['ln_terr']
+    rel_terr = temppackage['rel_terr']
 
     pressure_coeffs = pressurepackage['pressure_coeffs']
-    ln_perr = pressurepackage['ln_perr']
+    rel_perr = pressurepackage['rel_perr']
 
     r = radiuspackage[0]
     ln_r = radiuspackage[1]
     r_fine = radiuspackage[2]
     log10_r_fine = radiuspackage[3]
     ln_r_fine = radiuspackage[4]
-
-    # Assign the dlnp_dlnr array with same length as radius array
-    dlnp_dlnr = np.zeros(np.shape(ln_r))
-    for i in np.arange(1, 4):
-        dlnp_dlnr = dlnp_dlnr + \
-            float(i) * pressure_coeffs[i] * ln_r**(float(i - 1))
-
-    dlnp_dlnr_fine = np.zeros(np.shape(ln_r_fine))
-    for i in np.arange(1, 4):
-        dlnp_dlnr_fine = dlnp_dlnr_fine + \
-            float(i) * pressure_coeffs[i] * ln_r_fine**(float(i - 1))
-
-    mu_mp = const.m_p.to(u.g)  # Proton mass 1.67e-24 g
-
-    rg = - temp_fit.to(u.erg) / mu_mp * dlnp_dlnr
-    rg_fine = -temp_fit_fine.to(u.erg) / mu_mp * dlnp_dlnr_fine
-
-    relerr = np.sqrt(2. * np.exp(ln_perr)**2 + np.exp(ln_terr)**2)
-    rgerr = (temp_fit.to(u.erg) / mu_mp) * relerr
-
-    lowerbound = rg - rgerr
-    upperbound = rg + rgerr
-
-    plotter(r.to(u.kpc),
-            None,
-            r_fine.to(u.kpc),
-            rg,
-            rg_fine,
-            lowerbound,
-            upperbound,
-            xlog=True,
-            ylog=False,
-            xlim=(1.0, 100.),
-            ylim=(1.0e13, 1.2e16),
-            xlabel="Cluster-centric radius",
-            ylabel=r'$rg$ (cm$^2$ s$^{-2}$)',
-            title="Gravitational acceleration",
-            file="pressure.pdf",
-            save=False)
+    vander = radiuspackage[5]
+    vander_fine = radiuspackage[6]
+
+    # Analytically differentiate the log pressure polynomial, then
+    # evaluate it with the Vandermonde matrices the fits already used
+    dlnp_dlnr_coeffs = poly.polyder(pressure_coeffs)
+    ncoeffs = len(dlnp_dlnr_coeffs)
+
+    dlnp_dlnr = vander[:, :ncoeffs].dot(dlnp_dlnr_coeffs)
+    dlnp_dlnr_fine = vander_fine[:, :ncoeffs].dot(dlnp_dlnr_coeffs)
+
+    # kT / mu m_p, in cm^2 s^-2, for every keV of temperature. Folding
+    # the unit conversion into one scalar keeps the math on plain arrays.
+    kT_over_mu_mp = _KEV_TO_ERG / _MU_MP_G
+    rg_unit = u.cm**2 / u.s**2
+
+    kT_keV = temp_fit.to_value(u.keV)
+    kT_keV_fine = temp_fit_fine.to_value(u.keV)
+
+    rg = -kT_over_mu_mp * kT_keV * dlnp_dlnr * rg_unit
+    rg_fine = -kT_over_mu_mp * kT_keV_fine * dlnp_dlnr_fine * rg_unit
+
+    relerr = np.sqrt(2. * rel_perr**2 + rel_terr**2)
+    rgerr = kT_over_mu_mp * kT_keV * relerr * rg_unit
+
+    if show_plots:
+        lowerbound = rg - rgerr
+        upperbound = rg + rgerr
+
+        plotter(r.to(u.kpc),
+                None,
+                r_fine.to(u.kpc),
+                rg,
+                rg_fine,
+                lowerbound,
+                upperbound,
+                xlog=True,
+                ylog=False,
+                xlim=(1.0, 100.),
+                ylim=(1.0e13, 1.2e16),
+                xlabel="Cluster-centric radius",
+                ylabel=r'$rg$ (cm$^2$ s$^{-2}$)',
+                title="Gravitational acceleration",
+                file="pressure.pdf",
+                save=False)
 
     # Return everything you need for the rest of the code
     rgpackage = {'r': r, 'ln_r': ln_r, 'r_fine': r_fine,
@@ -440,81 +740,129 @@ def coolingFunction(kT):
                   + C_2\left( \frac{k_B T}{\mathrm{keV}} \right)^{0.5}
                   + C_3] \times 10^{-22}$
     """
+    # The kT in the real equation is divided by keV, so do the
+    # algebra on plain numbers in keV and attach units at the end.
+    kT_keV = kT.to(u.keV).value
+
+    coolingFunction = (_cooling_function(kT_keV) *
+                       (u.erg * u.cm**3 / u.s))
+
+    return coolingFunction
+
+
+@njit(cache=True, fastmath=True)
+def _cooling_function(kT_keV):
+    """Evaluate coolingFunction() on bare kT values in keV.
+
+    Return Lambda(T) as bare values in erg cm^3 s^-1.
+    """
     # For a metallicity of Z = 0.3 Z_solar,
     C1 = 8.6e-3
     C2 = 5.8e-2
     C3 = 6.3e-2
 
     alpha = -1.7
-    beta = 0.5
 
-    # kT.value is supposed to be unitless,
-    # the kT in the real equation is divided by keV. I'm not cheating!
-    coolingFunction = (C1 * kT.value**alpha
-                       + C2 * kT.value**beta
-                       + C3
-                       ) * 1.0e-22 * (u.erg * u.cm**3 / u.s)
+    # x**alpha = exp(alpha * ln x), and since beta = 0.5 the
+    # second power law is just a square root
+    return (C1 * np.exp(alpha * np.log(kT_keV))
+            + C2 * np.sqrt(kT_keV)
+            + C3
+            ) * 1.0e-22
 
-    return coolingFunction
 
+# No fastmath here: it would assume there are no NaNs, but tff is
+# NaN wherever the extrapolated rg goes negative.
+@njit(cache=True)
+def _timescales_kernel(r_cm, rg, kT_keV, pressure):
+    """Compute the freefall and cooling times, in s, from bare CGS arrays.
 
-def timescales(data):
+    R_CM is in cm, RG in cm^2 s^-2, KT_KEV in keV and PRESSURE
+    in dyne cm^-2. Return (tff, tcool).
     """
-    Compute the cooling and freefall timescales.
-
-    Do this from the log temperature and pressure profiles,
-    as well as the Tozzi & Norman cooling function.
-    """
-    rgpackage, temppackage, pressurepackage, radiuspackage = grav_accel(data)
-
     # Compute the freefall time
-    tff = np.sqrt(2.0 / rgpackage['rg']) * rgpackage['r']
-    tff_fine = np.sqrt(2.0 / rgpackage['rg_fine']) * rgpackage['r_fine']
+    tff = np.sqrt(2.0 / rg) * r_cm
 
     # Compute the cooling time
 
-    # Electron number density in units of cm**-3
-    nelec = pressurepackage['pressure_fit'] / (temppackage['temp_fit'])
-    nelec_fine = pressurepackage[
-        'pressure_fit_fine'] / (temppackage['temp_fit_fine'])
+    # The electron number density, in units of cm**-3, is n_e = P / kT.
     # See eqn 4 here: https://arxiv.org/pdf/astro-ph/0608423.pdf
 
     # Then the cooling time (via Cavagnolo+08) is
     # tcool = (3/2 nkT)/(ne np Lambda(T,Z))
-    capital_lambda = coolingFunction(temppackage['temp_fit'])
-    capital_lambda_fine = coolingFunction(temppackage['temp_fit_fine'])
+    capital_lambda = _cooling_function(kT_keV)
+    kT_erg = kT_keV * _KEV_TO_ERG
 
     # What is all of this?! See Eqn. 35 here: See here: arXiv:0706.1274.
-    tcool = ((3 / 2) *
-             (1.89 * pressurepackage['pressure_fit']) / (nelec**2 / 1.07) /
-             capital_lambda
-             )
-    tcool_fine = ((3 / 2) *
-                  (1.89 * pressurepackage['pressure_fit_fine']) /
-                  (nelec_fine**2 / 1.07) / capital_lambda_fine
-                  )
+    # tcool = (3/2) (1.89 P) / (n_e**2 / 1.07) / Lambda, and with
+    # n_e = P / kT that collapses to K kT**2 / (P Lambda).
+    tcool = 1.5 * 1.89 * 1.07 * kT_erg**2 / (pressure * capital_lambda)
+
+    return tff, tcool
+
+
+def timescales(data, show_plots=True, radiuspackage=None):
+    """
+    Compute the cooling and freefall timescales.
+
+    Do this from the log temperature and pressure profiles,
+    as well as the Tozzi & Norman cooling function.
+    """
+    rgpackage, temppackage, pressurepackage, radiuspackage = \
+        grav_accel(data, show_plots=show_plots,
+                   radiuspackage=radiuspackage)
+
+    # Do the math on bare arrays in CGS units; units are only
+    # attached again for plotting. rg is in cm^2 s^-2.
+    r_cm = rgpackage['r'].to_value(u.cm)
+    r_fine_cm = rgpackage['r_fine'].to_value(u.cm)
+
+    rg = rgpackage['rg'].to_value(u.cm**2 / u.s**2)
+    rg_fine = rgpackage['rg_fine'].to_value(u.cm**2 / u.s**2)
+
+    # kT in keV. Pressures are in dyne cm^-2 = erg cm^-3.
+    kT_keV = temppackage['temp_fit'].to_value(u.keV)
+    kT_keV_fine = temppackage['temp_fit_fine'].to_value(u.keV)
+
+    pressure = pressurepackage['pressure_fit'].to_value(u.dyne / u.cm**2)
+    pressure_fine = pressurepackage['pressure_fit_fine'].to_value(
+        u.dyne / u.cm**2)
+
+    # Compute the freefall and cooling times, in s. Ignore the sqrt
+    # warnings where rg <= 0, to keep the interpreter clean.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tff, tcool = _timescales_kernel(r_cm, rg, kT_keV, pressure)
+        tff_fine, tcool_fine = _timescales_kernel(r_fine_cm, rg_fine,
+                                                  kT_keV_fine, pressure_fine)
+
+    precip_ratio_fine = tcool_fine / tff_fine
+
+    if not show_plots:
+        return
 
-    precip_ratio_fine = tcool_fine.to(u.yr) / tff_fine.to(u.yr)
+    colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
 
     plt.figure()
 
     # Plot the freefall time
-    plt.plot(rgpackage['r'].to(u.kpc), tff.to(u.yr), label='Freefall Time',
-             color=plt.rcParams['axes.prop_cycle'].by_key()['color'][0])
-    plt.plot(rgpackage['r_fine'].to(u.kpc), tff_fine.to(u.yr), linestyle='--',
-             color=plt.rcParams['axes.prop_cycle'].by_key()['color'][0])
+    plt.plot(rgpackage['r'].to(u.kpc), (tff * u.s).to(u.yr),
+             label='Freefall Time',
+             color=colors[0])
+    plt.plot(rgpackage['r_fine'].to(u.kpc), (tff_fine * u.s).to(u.yr),
+             linestyle='--',
+             color=colors[0])
 
     # Plot the (various) coooling times
     plt.plot(rgpackage['r'].to(u.kpc),
-             (tcool.to(u.yr)),
+             (tcool * u.s).to(u.yr),
              label='Cooling Time',
-             color=plt.rcParams['axes.prop_cycle'].by_key()['color'][1]
+             color=colors[1]
              )
 
     plt.plot(rgpackage['r_fine'].to(u.kpc),
-             (tcool_fine.to(u.yr)),
+             (tcool_fine * u.s).to(u.yr),
              linestyle='--',
-             color=plt.rcParams['axes.prop_cycle'].by_key()['color'][1]
+             color=colors[1]
              )
 
     plt.fill_between(rgpackage['r'].to(u.kpc).value,
@@ -553,13 +901,6 @@ def plotter(x, y, x_fine, fit, fit_fine, lowerbound, upperbound,
             xlabel="Set your X-label!", ylabel="Set your y label!",
             title="Set your title!", file="temp.pdf", save=False):
     """Make plots pretty."""
-    style.use('ggplot')
-
-    plt.rcParams['font.size'] = 12
-    plt.rcParams['axes.labelsize'] = 12
-    plt.rcParams['xtick.labelsize'] = 12
-    plt.rcParams['ytick.labelsize'] = 12
-
     plt.figure()
 
     # Only plot datapoints if I gave you datapoints
@@ -595,6 +936,16 @@ def plotter(x, y, x_fine, fit, fit_fine, lowerbound, upperbound,
     plt.draw()
 
 
+def _configure_matplotlib():
+    """Set the plot style once, rather than on every plotter() call."""
+    style.use('ggplot')
+
+    plt.rcParams['font.size'] = 12
+    plt.rcParams['axes.labelsize'] = 12
+    plt.rcParams['xtick.labelsize'] = 12
+    plt.rcParams['ytick.labelsize'] = 12
+
+
 def make_number_ordinal(number):
     """Take number, turn into ordinal. E.g., '2' --> '2nd'."""
     suffixes = {1: 'st', 2: 'nd', 3: 'rd'}
@@ -609,31 +960,46 @@ def make_number_ordinal(number):
 
 def rainmaker_notebook_init(filename, cluster_name):
     """Run this in a Jupyter Notebook for exploration."""
+    _configure_matplotlib()
+
     data = parse_data_table(filename, cluster_name.replace(" ", "_").upper())
 
     return data
 
 
 def main():
-    """The main program runs the whole sequence."""
-    # Parse command line arguments. Iterate with user if cluster not found.
+    """The main program runs the whole sequence.
+
+    Return whether plots were requested, so the caller knows
+    whether to show them.
+    """
+    # Parse command line arguments
     filename, cluster_name, show_plots = parse_arguments()
 
+    if show_plots:
+        _configure_matplotlib()
+
     # DATA is an astropy TABLE object,
     # filtered to show all properties of a given cluster
     # Can be split by e.g. data['Rin'], data['Mgrav'], etc.
-    data = parse_data_table(filename, cluster_name)
+    try:
+        data = parse_data_table(filename, cluster_name)
+    except ClusterNotFoundError as error:
+        sys.exit(error)
 
     # grav_accel(data)
-    timescales(data)
+    timescales(data, show_plots=show_plots)
+
+    return show_plots
 
 
 if __name__ == '__main__':
     start_time = time.time()
-    main()
+    show_plots = main()
     runtime = round((time.time() - start_time), 3)
     print("Finished in    |  {} seconds".format(runtime))
 
-    print("Showing plots  |")
+    if show_plots:
+        print("Showing plots  |")
 
-    plt.show()
+        plt.show()
@@ -1,12 +1,21 @@
 #!/usr/bin/env python
 
+import io
 import os
 import sys
+import argparse
+import contextlib
+import shutil
+import tempfile
+import warnings
 from astropy.io import ascii
+from astropy.table import Table, vstack
 import astropy.units as u
 import astropy.constants as const
 
 import numpy as np
+import numpy.polynomial.polynomial as poly
+import matplotlib.pyplot as plt
 
 import unittest
 
@@ -42,22 +51,147 @@ filename = os.path.join(os.path.dirname(os.path.realpath(__file__)),
 class TestBasics(unittest.TestCase):
     '''Test basic functionality to ensure the code is alive'''
 
+    @classmethod
+    def setUpClass(cls):
+        # Reading the table writes a cache next to it, so work on a
+        # copy rather than writing into tests/testdata
+        cls.tempdir = tempfile.mkdtemp()
+        cls.filename = os.path.join(cls.tempdir, 'testdata.txt')
+        shutil.copy(filename, cls.filename)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tempdir)
+
     def test_parse_data_table(self):
 
-        returned_data = rainmaker.parse_data_table(filename, cluster_name)
+        returned_data = rainmaker.parse_data_table(self.filename, cluster_name)
         self.assertTrue(cluster_name in returned_data['Name'])
 
+    def test_read_data_table_cache(self):
+
+        tempdir = tempfile.mkdtemp()
+        try:
+            tablefile = os.path.join(tempdir, 'testdata.txt')
+            shutil.copy(filename, tablefile)
+
+            parsed_data = rainmaker.read_data_table(tablefile)
+            self.assertTrue(os.path.isfile(
+                os.path.join(tempdir, 'testdata.txt.rainmaker-cache.fits')))
+
+            # Skip the in-memory cache, so the FITS file is read back
+            rainmaker._read_data_table.cache_clear()
+            cached_data = rainmaker.read_data_table(tablefile)
+            rainmaker.read_data_table(tablefile)
+            self.assertEqual(rainmaker._read_data_table.cache_info().misses, 1)
+            self.assertEqual(parsed_data.colnames, cached_data.colnames)
+            self.assertTrue(cluster_name in cached_data['Name'])
+            self.assertTrue(cached_data['Tx'].unit == u.keV)
+            self.assertTrue(np.all(parsed_data['Tx'] == cached_data['Tx']))
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_read_data_table_copy(self):
+
+        data = rainmaker.read_data_table(self.filename)
+        tx = data['Tx'].copy()
+        data['Tx'] *= 2
+
+        # Changing one caller's table mustn't change the cached one
+        fresh_data = rainmaker.read_data_table(self.filename)
+        self.assertFalse(data is fresh_data)
+        self.assertTrue(np.all(fresh_data['Tx'] == tx))
+
+        cluster_data = rainmaker.parse_data_table(self.filename, cluster_name)
+        cluster_data['Tx'] *= 2
+        self.assertTrue(np.all(
+            rainmaker.read_data_table(self.filename)['Tx'] == tx))
+
+    def test_read_data_table_damaged_cache(self):
+
+        tempdir = tempfile.mkdtemp()
+        try:
+            tablefile = os.path.join(tempdir, 'testdata.txt')
+            shutil.copy(filename, tablefile)
+            parsed_data = rainmaker.read_data_table(tablefile)
+
+            # Cut the cache short, as an interrupted write would
+            cache = tablefile + '.rainmaker-cache.fits'
+            size = os.path.getsize(cache)
+            with open(cache, 'r+b') as f:
+                f.truncate(size // 2)
+
+            rainmaker._read_data_table.cache_clear()
+            data = rainmaker.read_data_table(tablefile)
+            self.assertTrue(np.all(parsed_data['Tx'] == data['Tx']))
+
+            # The cache was replaced, and no temporary file was left
+            self.assertEqual(os.path.getsize(cache), size)
+            self.assertEqual(sorted(os.listdir(tempdir)),
+                             ['testdata.txt', 'testdata.txt.rainmaker-cache.fits'])
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_read_data_table_foreign_cache(self):
+
+        tempdir = tempfile.mkdtemp()
+        try:
+            tablefile = os.path.join(tempdir, 'testdata.txt')
+            shutil.copy(filename, tablefile)
+
+            # A FITS file that rainmaker didn't write sits at the cache path
+            cache = tablefile + '.rainmaker-cache.fits'
+            Table({'x': [1, 2, 3]}).write(cache, format='fits')
+            with open(cache, 'rb') as f:
+                contents = f.read()
+
+            data = rainmaker.read_data_table(tablefile)
+            self.assertTrue(cluster_name in data['Name'])
+            with open(cache, 'rb') as f:
+                self.assertEqual(contents, f.read())
+        finally:
+            shutil.rmtree(tempdir)
+
     def test_filter_by_cluster(self):
 
-        data = ascii.read(filename)
+        data = ascii.read(self.filename)
 
         masked_data = rainmaker.filter_by_cluster(data, cluster_name)
         self.assertTrue(cluster_name in masked_data['Name'])
         return masked_data
 
+    def test_filter_by_cluster_sorted(self):
+
+        data = ascii.read(self.filename)
+        masked_data = rainmaker.filter_by_cluster(data, cluster_name)
+
+        # parse_data_table() binary searches the sorted cached table
+        sorted_data = rainmaker.parse_data_table(self.filename, cluster_name)
+
+        self.assertEqual(len(masked_data), len(sorted_data))
+        self.assertTrue(np.all(masked_data['Rin'] == sorted_data['Rin'].value))
+
+        # Tables re-sorted by the caller are still searched correctly
+        resorted_data = rainmaker.read_data_table(self.filename)
+        resorted_data.sort('Tx')
+        resorted_data = rainmaker.filter_by_cluster(resorted_data,
+                                                    cluster_name)
+        self.assertEqual(len(masked_data), len(resorted_data))
+
+        with self.assertRaises(rainmaker.ClusterNotFoundError):
+            rainmaker.parse_data_table(self.filename, 'ABELL_2579')
+
+    def test_filter_by_cluster_not_found(self):
+
+        data = ascii.read(self.filename)
+
+        with self.assertRaises(rainmaker.ClusterNotFoundError) as context:
+            rainmaker.filter_by_cluster(data, 'ABELL_2579')
+        self.assertTrue(cluster_name in str(context.exception))
+
     def test_assign_units(self):
 
-        data = rainmaker.parse_data_table(filename, "ABELL_2597")
+        data = rainmaker.parse_data_table(self.filename, "ABELL_2597")
 
         massValue = data['Mgrav'][0]
         radiusValue = data['Rin'][0]
@@ -67,15 +201,67 @@ class TestBasics(unittest.TestCase):
 
     def test_fit_polynomial(self):
 
-        data = rainmaker.parse_data_table(filename, "ABELL_2597")
+        data = rainmaker.parse_data_table(self.filename, "ABELL_2597")
 
         ln_t = np.log(data['Tx'].value)
         ln_terr = np.log(data['Txerr'] / data['Tx'])
 
-        fit, r, fit_fine, r_fine, temp_coeffs = rainmaker.fit_polynomial(data, ln_t, deg=3, whatIsFit="Test")
+        ln_fit, fit, r, ln_fit_fine, fit_fine, r_fine, temp_coeffs = rainmaker.fit_polynomial(data, ln_t, deg=3, whatIsFit="Test")
         self.assertTrue(len(temp_coeffs) == 4)
+        self.assertTrue(np.allclose(np.exp(ln_fit), fit))
         # THIS IS A DUMB TEST. FIX IT!
 
+    def test_fit_polynomial_matches_polyfit(self):
+
+        data = rainmaker.parse_data_table(self.filename, cluster_name)
+        ln_r = np.log(((data['Rin'] + data['Rout']) * 0.5).value)
+        ln_t = np.log(data['Tx'].value)
+
+        for deg in (2, 3):
+            coeffs = rainmaker.fit_polynomial(data, ln_t, deg=deg,
+                                              whatIsFit="Test")[6]
+            self.assertTrue(np.allclose(coeffs, poly.polyfit(ln_r, ln_t, deg)))
+
+        # Three radii are too few for the shared QR factors
+        coeffs = rainmaker.fit_polynomial(data[:3], ln_t[:3], deg=2,
+                                          whatIsFit="Test")[6]
+        self.assertTrue(np.allclose(coeffs,
+                                    poly.polyfit(ln_r[:3], ln_t[:3], 2)))
+
+    def test_fit_polynomial_repeated_radii(self):
+
+        data = rainmaker.parse_data_table(self.filename, cluster_name)
+
+        # Four rows, but only two distinct radii
+        data = vstack([data[:2], data[:2]])
+        ln_r = np.log(((data['Rin'] + data['Rout']) * 0.5).value)
+        ln_t = np.log(data['Tx'].value)
+
+        coeffs = rainmaker.fit_polynomial(data, ln_t, deg=2,
+                                          whatIsFit="Test")[6]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', np.exceptions.RankWarning)
+            expected = poly.polyfit(ln_r, ln_t, 2)
+        self.assertTrue(np.allclose(coeffs, expected))
+
+    def test_str_to_bool(self):
+
+        parser = argparse.ArgumentParser()
+        self.assertTrue(rainmaker.str_to_bool(parser, 'False') is False)
+        self.assertTrue(rainmaker.str_to_bool(parser, 'True') is True)
+
+        with self.assertRaises(SystemExit):
+            with contextlib.redirect_stderr(io.StringIO()):
+                rainmaker.str_to_bool(parser, 'Maybe')
+
+    def test_timescales_without_plots(self):
+
+        data = rainmaker.parse_data_table(self.filename, cluster_name)
+
+        plt.close('all')
+        rainmaker.timescales(data, show_plots=False)
+        self.assertEqual(plt.get_fignums(), [])
+
     def test_make_number_ordinal(self):
 
         number = rainmaker.make_number_ordinal(3)
@@ -86,7 +272,7 @@ class TestBasics(unittest.TestCase):
 
     def test_extrapolate_radius(self):
 
-        data = rainmaker.parse_data_table(filename, "ABELL_2597")
+        data = rainmaker.parse_data_table(self.filename, "ABELL_2597")
 
         radiuspackage = rainmaker.extrapolate_radius(data)
         expected = 300
@@ -95,6 +281,12 @@ class TestBasics(unittest.TestCase):
         self.assertEqual(expected, actual,
                               'Radius package should have 300 elements')
 
+        # Plain tables without units work too
+        data = rainmaker.filter_by_cluster(ascii.read(self.filename),
+                                           cluster_name)
+        radiuspackage = rainmaker.extrapolate_radius(data)
+        self.assertEqual(len(radiuspackage[0]), len(data))
+
 
 if __name__ == '__main__':
     unittest.main()